@@ -6,9 +6,13 @@ How it works:
 The script visits a single source page - which links to all of the sources rated by Ad Fontes
 Media - and then follows each link to the page that contains the actual ratings. As a result,
 the Ad Fontes site will block the script for automated visits if not other precautions are taken.
-In order to avoid being IP blocked, the script implements a random wait period between 1 and 10
-seconds before visiting each new page. As a result, the script takes a while to complete and
-should be run in the background.
+In order to avoid being IP blocked, pages are fetched by a small pool of worker threads that share
+a rate limiter, which keeps requests to the site at least 2 seconds apart. As a result, the script
+takes a while to complete and should be run in the background.
+
+Pages are cached locally (adfontes_cache.sqlite) for 7 days, so reruns within that window skip
+pages that were already downloaded. Rows are written as each source is scraped, so if the script
+is interrupted, running it again within 7 days resumes where it left off.
 
 Output:
 - A CSV file where the columns are: source, reliability, and bias.
@@ -16,16 +20,175 @@ Output:
 Ad Fontes says that they update their chart on a regular basis, so the script should probably be run once a month.
 """
 
-import random
-import requests
+import csv
+import os
+import re
+import sys
+import threading
 import time
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 
-import pandas as pd
-from bs4 import BeautifulSoup
+import requests_cache
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError
+from selectolax.lexbor import LexborHTMLParser
+from urllib3.util.retry import Retry
 
 NUM_PAGES = 1
+MAX_WORKERS = 4
 SOURCE_WEB_PAGE = "https://adfontesmedia.com/rankings-by-individual-news-source/"
+REQUEST_TIMEOUT = 30
+OUTPUT_FILE = "ad_fontes_media_sources_ratings.csv"
+OUTPUT_FIELDS = ["source", "reliability", "bias"]
+# Rows are written here while scraping and the file is renamed to OUTPUT_FILE once the
+# run completes, so an interrupted run can be resumed without redoing finished sources
+PARTIAL_OUTPUT_FILE = f"{OUTPUT_FILE}.partial"
+# Present as a regular browser rather than python-requests, which is an easy bot signal
+REQUEST_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+CACHE_NAME = "adfontes_cache"
+CACHE_EXPIRE_AFTER = timedelta(days=7)
+# Dead links are cached too so that reruns don't keep requesting (and waiting on) them
+GONE_STATUS_CODES = (404, 410)
+CACHE_ALLOWABLE_CODES = (200, *GONE_STATUS_CODES)
+# Minimum number of seconds between two requests that actually reach the Ad Fontes site
+MIN_REQUEST_INTERVAL = 2
+# Only links pointing back to Ad Fontes lead to a source's ratings page
+_HREF_PREFIX = "https://adfontesmedia.com"
+# Removes tabs and newlines from the source names in a single pass
+_STRIP_TABLE = str.maketrans("", "", "\t\n")
+# Matches ratings such as `<strong>Reliability: 45.18</strong>` in a source's page, allowing
+# a few spaces, non-breaking space entities and tags between the opening tag, label, colon and
+# score. The gaps are bounded so that long runs of tags can't make matching quadratic.
+_GAP = r"\s*(?:(?:&nbsp;|&#160;|&#xa0;|<[^>]*>)\s*){0,10}"
+_NEGATIVE_SIGNS = {"-", "\u2212", "&minus;", "&#8722;", "&#x2212;"}
+METRIC_RE = re.compile(
+    rf"<strong[^>]*>{_GAP}(Reliability|Bias){_GAP}:{_GAP}"
+    r"([-+\u2212]|&minus;|&#8722;|&#x2212;)?(\d+(?:\.\d+)?)",
+    re.I,
+)
+
+
+class RateLimiter:
+    """
+    Enforce a minimum interval between consecutive requests, shared across threads.
+
+    Each caller reserves the next free time slot while holding the lock and then
+    sleeps outside of it, so waiting threads don't block each other from booking
+    their own slot.
+
+    Parameters:
+    ----------
+    - min_interval (float) : the minimum number of seconds between two requests
+    """
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def __enter__(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter that waits for a RateLimiter before sending each request.
+
+    Adapters are only reached on cache misses, so pages served from the cache
+    are never slowed down by the rate limit.
+
+    Parameters:
+    ----------
+    - limiter (RateLimiter) : the limiter to wait on before every request
+    - **kwargs : passed on to requests.adapters.HTTPAdapter
+    """
+
+    def __init__(self, limiter, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        with self.limiter:
+            return super().send(request, **kwargs)
+
+
+class RateLimitedRetry(Retry):
+    """
+    A urllib3 Retry that also waits for a RateLimiter before every retry.
+
+    urllib3 retries inside HTTPAdapter.send, so without this the retries that follow
+    a 429 or 5xx response would skip the limiter exactly when the site is struggling.
+
+    Parameters:
+    ----------
+    - limiter (RateLimiter) : the limiter to wait on before every retry
+    - **kwargs : passed on to urllib3.util.retry.Retry
+    """
+
+    def __init__(self, *args, limiter=None, **kwargs):
+        self.limiter = limiter
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kwargs):
+        # urllib3 builds a fresh Retry after every attempt without passing on extra arguments
+        retry = super().new(**kwargs)
+        retry.limiter = self.limiter
+        return retry
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.limiter is not None:
+            with self.limiter:
+                pass
+
+
+# Shared by the adapter and its retries so that every attempt counts towards the limit
+REQUEST_LIMITER = RateLimiter(MIN_REQUEST_INTERVAL)
+
+# Every page lives on the same host, so share one keep-alive connection pool across
+# all requests (and worker threads) instead of opening a new TCP/TLS connection each time.
+# Responses are also cached in a local SQLite database so that reruns don't download
+# pages that were already fetched recently.
+SESSION = requests_cache.CachedSession(
+    CACHE_NAME,
+    backend="sqlite",
+    expire_after=CACHE_EXPIRE_AFTER,
+    allowable_codes=CACHE_ALLOWABLE_CODES,
+)
+SESSION.headers.update(REQUEST_HEADERS)
+SESSION.mount(
+    "https://",
+    RateLimitedAdapter(
+        REQUEST_LIMITER,
+        # One host, and at most one open connection per worker thread
+        pool_connections=1,
+        pool_maxsize=MAX_WORKERS,
+        pool_block=True,
+        max_retries=RateLimitedRetry(
+            limiter=REQUEST_LIMITER,
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    ),
+)
 
 
 def extract_name_and_link(a_object):
@@ -34,26 +197,78 @@ def extract_name_and_link(a_object):
 
     Parameters:
     ----------
-    - a_object (bs4.element.Tag - `a`) : an a object html tag parsed by beautiful soup 4
+    - a_object (selectolax.lexbor.LexborNode - `a`) : an a object html tag parsed by selectolax
 
     Returns:
     ----------
     - source_name (str) : the plain text source name as included by Ad Fontes Media
     - link (str) : the url location where Ad Fontes Media stores the reliability and bias data
     """
-    if (
-        (a_object is not None)
-        and (a_object["href"] is not None)
-        and (a_object["href"].startswith("https://adfontesmedia.com"))
-    ):
-        source_name, link = a_object.get_text(), a_object["href"]
-        source_name = source_name.replace("\t", "").replace("\n", "")
-        source_name = source_name.replace(" Bias and Reliability", "")
+    link = a_object.attributes.get("href") if a_object is not None else None
+    if link and link.startswith(_HREF_PREFIX):
+        source_name = a_object.text()
+        source_name = (
+            source_name.translate(_STRIP_TABLE)
+            .strip()
+            .removesuffix(" Bias and Reliability")
+        )
         return source_name, link
     else:
         return None, None
 
 
+def load_scraped_sources(file_path):
+    """
+    Collect the names of the sources that have already been written to an output file.
+
+    Parameters:
+    ----------
+    - file_path (str) : the path to a CSV file with the columns `OUTPUT_FIELDS`
+
+    Returns:
+    ---------
+    - scraped_sources (set) : the source names in the file, or an empty set if the
+        file doesn't exist
+    """
+    if not os.path.exists(file_path):
+        return set()
+
+    with open(file_path, newline="") as f:
+        return {row["source"] for row in csv.DictReader(f)}
+
+
+def write_sorted_output(partial_path, output_path, source_order):
+    """
+    Write the rows of a partial output file to the final output file in the order the
+    sources appear on Ad Fontes, since rows are written in whatever order their pages
+    finish. The sorted rows go to a temporary file that replaces `output_path` in one
+    step, and the partial file is only removed afterwards, so an interruption at any
+    point leaves the scraped rows on disk.
+
+    Parameters:
+    ----------
+    - partial_path (str) : the path to a CSV file with the columns `OUTPUT_FIELDS`
+    - output_path (str) : the path that the sorted CSV file is written to
+    - source_order (list of str) : the source names in the order they should appear.
+        Sources that aren't listed are kept, after the listed ones.
+    """
+    position = {source: i for i, source in enumerate(source_order)}
+
+    with open(partial_path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = sorted(reader, key=lambda row: position.get(row[0], len(position)))
+
+    temp_path = f"{output_path}.tmp"
+    with open(temp_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    os.replace(temp_path, output_path)
+    os.remove(partial_path)
+
+
 def get_all_rated_sources(page_num):
     """
     Collect all of the rated sources and the url location where Ad Fontes Media
@@ -71,13 +286,14 @@ def get_all_rated_sources(page_num):
     print("Extracting links for the rated sources...")
     full_url = f"{SOURCE_WEB_PAGE}{page_num}/" if page_num > 1 else SOURCE_WEB_PAGE
     print("\t- Visiting:", full_url)
-    html_text = requests.get(full_url).text
-    soup = BeautifulSoup(html_text, "html.parser")
-    print("\t- Soup collected...")
+    response = SESSION.get(full_url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    tree = LexborHTMLParser(response.content)
+    print("\t- Page parsed...")
 
     rated_sources = []
-    for item in soup.find_all("h3"):
-        a_obj = item.find("a")
+    for item in tree.css("h3"):
+        a_obj = item.css_first("a")
         source_name, link = extract_name_and_link(a_obj)
         if (source_name is not None) and (link is not None):
             rated_sources.append((source_name, link))
@@ -85,71 +301,154 @@ def get_all_rated_sources(page_num):
     return rated_sources
 
 
-def get_reliability_and_bias_info(rated_sources):
+def fetch_and_parse(site_name, site_url):
     """
-    Visit and extract the rated sources gathered from As Fontes.
+    Visit a single rated source's page and extract its reliability and bias scores.
+
+    Parameters:
+    ----------
+    - site_name (str) : the plain text source name as included by Ad Fontes Media
+    - site_url (str) : the url location where Ad Fontes Media stores the reliability and bias data
+
+    Returns:
+    ---------
+    - row (tuple) : a tuple of the following form, matching `OUTPUT_FIELDS`
+        (site_name, reliability, bias)
+    """
+    print("\t- Working on:", site_name)
+    response = SESSION.get(site_url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    # Only two numbers are needed from each page, so skip building a DOM entirely
+    temp_info = {}
+    for match in METRIC_RE.finditer(response.text):
+        metric_name, sign, metric_score = match.groups()
+        metric_score = float(metric_score)
+        if sign is not None and sign.lower() in _NEGATIVE_SIGNS:
+            metric_score = -metric_score
+        temp_info[metric_name.lower()] = metric_score
+
+    # Raise rather than write a blank row, which would mark the source as done on resume
+    missing = [metric for metric in OUTPUT_FIELDS[1:] if metric not in temp_info]
+    if missing:
+        raise ValueError(f"no {' or '.join(missing)} score found on {site_url}")
+
+    return site_name, temp_info["reliability"], temp_info["bias"]
+
+
+def get_reliability_and_bias_info(rated_sources, writer):
+    """
+    Visit and extract the rated sources gathered from As Fontes, writing each
+    source's scores out as soon as its page has been processed.
+
+    Pages are fetched by a small pool of `MAX_WORKERS` threads. Requests that
+    aren't served from the cache are spaced at least `MIN_REQUEST_INTERVAL`
+    seconds apart across all threads, so workers can parse pages while others wait.
 
     Parameters:
     ----------
     - rated_sources (list of tuples) : a list of tuples of the following form
         [(site_name1, site_url1), (site_name2, site_url2), ...]
+    - writer (csv.writer) : the writer that each row is written to. Rows take the
+        following form, matching `OUTPUT_FIELDS`
+        (site_name, reliability, bias)
 
     Returns:
     ---------
-    - scraped_info (defaultdict) : a dictionary of the following form
-        {'site 1': {'reliability': XXX, 'bias': XXX},
-         'site 2': {'reliability': XXX, 'bias': XXX},
-         ....
-        }
+    - failed_sources (list of str) : the names of the sources that couldn't be scraped,
+        which have no row in the output. Sources whose page no longer exists are skipped
+        and not included.
     """
     num_sites_2_scrape = len(rated_sources)
     sitecount = 0
-
-    scraped_info = defaultdict(dict)
+    failed_sources = []
 
     print(f"Extracting reliability and bias scores from {num_sites_2_scrape} sites")
-    for site_name, site_url in rated_sources:
-        random_num_seconds = random.randrange(1, 10)
-        print(f"\t- Waiting for {random_num_seconds} seconds so we don't get blocked.")
-        time.sleep(random_num_seconds)
-        print("\t- Working on:", site_name)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(fetch_and_parse, site_name, site_url): site_name
+            for site_name, site_url in rated_sources
+        }
+        try:
+            for future in as_completed(futures):
+                site_name = futures[future]
 
-        html_text = requests.get(site_url).text
-        html_soup = BeautifulSoup(html_text, "html.parser")
+                if sitecount % 25 == 0:
+                    print(f"{sitecount} sites processed...")
+                sitecount += 1
 
-        if sitecount % 25 == 0:
-            print(f"{sitecount} sites processed...")
-        sitecount += 1
+                try:
+                    writer.writerow(future.result())
 
-        try:
-            temp_info = {}
-            for item in html_soup.find_all("p"):
-                rating = item.find("strong")
-                if rating and ":" in rating.get_text():
-                    metric_name, metric_score = map(
-                        str.strip, rating.get_text().split(":")
-                    )
-                    temp_info[metric_name.lower()] = float(metric_score)
-            scraped_info[site_name] = temp_info
+                except HTTPError as e:
+                    # Pages that are gone won't come back on a retry, so don't count them
+                    if e.response.status_code in GONE_STATUS_CODES:
+                        print(f"Skipping {site_name}, its page no longer exists: {e}")
+                    else:
+                        print(f"Error processing {site_name}: {e}")
+                        failed_sources.append(site_name)
 
-        except Exception as e:
-            print(f"Error processing {site_name}: {e}")
+                except Exception as e:
+                    print(f"Error processing {site_name}: {e}")
+                    failed_sources.append(site_name)
 
-    return scraped_info
+        except BaseException:
+            # Otherwise leaving the `with` block waits for every queued page to be fetched
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
 
+    return failed_sources
 
-if __name__ == "__main__":
 
-    dfs = []
-    for page_num in range(1, NUM_PAGES + 1):
-        rated_sources = get_all_rated_sources(page_num)
-        scraped_info = get_reliability_and_bias_info(rated_sources)
-        temp_df = pd.DataFrame.from_dict(scraped_info, orient="index")
-        dfs.append(temp_df)
+if __name__ == "__main__":
 
-    scraped_info_df = pd.concat(dfs)
-    scraped_info_df = scraped_info_df.rename(columns={"index": "source"})
-    scraped_info_df = scraped_info_df.reset_index()
+    # A partial file left from an older run (e.g. last month's) would mix stale scores
+    # into the output, so only resume from one that is as recent as the page cache
+    if os.path.exists(PARTIAL_OUTPUT_FILE):
+        partial_age = timedelta(
+            seconds=round(time.time() - os.path.getmtime(PARTIAL_OUTPUT_FILE))
+        )
+        if partial_age > CACHE_EXPIRE_AFTER:
+            print(f"Discarding {PARTIAL_OUTPUT_FILE}, last written {partial_age} ago.")
+            os.remove(PARTIAL_OUTPUT_FILE)
+
+    scraped_sources = load_scraped_sources(PARTIAL_OUTPUT_FILE)
+    if scraped_sources:
+        print(
+            f"Resuming a previous run last written {partial_age} ago, "
+            f"{len(scraped_sources)} sources already scraped."
+        )
+
+    # Dict keys keep the index page order while ignoring sources listed on several pages
+    source_order = {}
+    failed_sources = []
+
+    # Line buffering flushes every row to disk as soon as it's written
+    with open(PARTIAL_OUTPUT_FILE, "a", newline="", buffering=1) as f:
+        writer = csv.writer(f)
+        if f.tell() == 0:
+            writer.writerow(OUTPUT_FIELDS)
+        for page_num in range(1, NUM_PAGES + 1):
+            # A source listed more than once is only scraped (and written) once
+            page_sources = dict(get_all_rated_sources(page_num))
+            rated_sources = [
+                (site_name, site_url)
+                for site_name, site_url in page_sources.items()
+                if site_name not in scraped_sources
+            ]
+            source_order.update(dict.fromkeys(page_sources))
+            scraped_sources.update(page_sources)
+            failed_sources += get_reliability_and_bias_info(rated_sources, writer)
+
+    if failed_sources:
+        # Keep the partial file so that the next run only retries the failed sources
+        print(f"{len(failed_sources)} sources could not be scraped:")
+        for site_name in failed_sources:
+            print(f"\t- {site_name}")
+        print(f"Scraped rows are saved in {PARTIAL_OUTPUT_FILE}, rerun to retry the rest.")
+        sys.exit(1)
+
+    # Keep the row order stable between runs so that monthly outputs diff cleanly
+    write_sorted_output(PARTIAL_OUTPUT_FILE, OUTPUT_FILE, list(source_order))
 
-    scraped_info_df.to_csv("ad_fontes_media_sources_ratings.csv", index=False)
     print("--- Script Complete ---")